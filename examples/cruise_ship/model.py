@@ -8,47 +8,157 @@ Version: 2020mar20
 '''
 
 #%% Imports
+import os
+import tempfile
 import numba as nb
 import numpy as np
 import pylab as pl
 import sciris as sc
+import scipy.stats as sps
 import covasim as cv
 import parameters as cova_pars
 
 
 # Specify all externally visible functions this file defines
-__all__ = ['Person', 'Sim']
+__all__ = ['Person', 'PersonArray', 'Sim', 'single_run', 'multi_run']
+
+# Each person's state is stored as bits of a single uint8, so combinations of states can be checked and counted in a single pass
+EXPOSED    = np.uint8(1)
+INFECTIOUS = np.uint8(2)
+RECOVERED  = np.uint8(4)
+DIAGNOSED  = np.uint8(8)
+ON_SHIP    = np.uint8(16)
+ALIVE      = np.uint8(32)
+
+# Dates are stored as small integers, with the maximum value meaning the event is not scheduled
+date_dtype = np.int16
+no_date = np.iinfo(date_dtype).max
 
 
 #%% Define classes
 
+def state_property(bit, doc):
+    ''' Create a read-only boolean view of one bit of PersonArray.state '''
+    return property(lambda self: (self.state & bit) != 0, doc=doc)
+
+
 class Person(cv.Person):
     '''
-    Class for a single person.
+    Class for a single person. Note: this is only a view of a single row of the
+    PersonArray, since sim.people stores each property as an array.
     '''
-    def __init__(self, age=0, sex=0, crew=False, contacts=0):
-        self.uid      = str(pl.randint(0,1e9)) # Unique identifier for this person
+    def __init__(self, uid=None, age=0, sex=0, crew=False, contacts=0):
+        self.uid      = uid # Unique identifier for this person
         self.age      = float(age) # Age of the person (in years)
         self.sex      = sex # Female (0) or male (1)
         self.crew     = crew # Wehther the person is a crew member
         self.contacts = contacts # Determine how many contacts they have
+        return
+
+
+class PersonArray(sc.prettyobj):
+    '''
+    Class for storing all the people as parallel arrays (one array per property)
+    rather than as a dictionary of Person objects. Use people[ind] to get a
+    Person view of a single row, or people['key'] to get the array.
 
-        # Define state
-        self.alive       = True
-        self.susceptible = True
-        self.exposed     = False
-        self.infectious  = False
-        self.diagnosed   = False
-        self.recovered   = False
-
-        # Keep track of dates
-        self.date_exposed    = None
-        self.date_infectious = None
-        self.date_diagnosed  = None
-        self.date_recovered  = None
+    The states are packed as bits into a single array, people.state, which should
+    be used to update them; people.exposed etc. return boolean copies.
+    '''
+
+    alive      = state_property(ALIVE,      'Whether each person is alive')
+    exposed    = state_property(EXPOSED,    'Whether each person is exposed (including infectious)')
+    infectious = state_property(INFECTIOUS, 'Whether each person is infectious')
+    diagnosed  = state_property(DIAGNOSED,  'Whether each person has been diagnosed')
+    recovered  = state_property(RECOVERED,  'Whether each person has recovered')
+    on_ship    = state_property(ON_SHIP,    'Whether each person is still on the ship')
+
+    @property
+    def susceptible(self):
+        ''' Whether each person is susceptible, i.e. neither exposed nor recovered '''
+        return (self.state & (EXPOSED | RECOVERED)) == 0
+
+    person_keys = ['uid', 'age', 'sex', 'crew', 'contacts']
+    state_keys  = ['alive', 'susceptible', 'exposed', 'infectious', 'diagnosed', 'recovered', 'on_ship']
+    date_keys   = ['date_exposed', 'date_infectious', 'date_diagnosed', 'date_recovered']
+
+    def __init__(self, n=0):
+        n = int(n)
+        self.uid      = np.arange(n, dtype=np.int32) # Unique identifier for each person, the same as their index
+        self.age      = np.zeros(n, dtype=np.float64) # Age of each person (in years)
+        self.sex      = np.zeros(n, dtype=np.int8) # Female (0) or male (1)
+        self.crew     = np.zeros(n, dtype=bool) # Whether the person is a crew member
+        self.contacts = np.zeros(n, dtype=np.float64) # Number of contacts per day
+
+        # Define state -- everyone starts alive, susceptible, and on the ship
+        self.state = np.full(n, ALIVE | ON_SHIP, dtype=np.uint8)
+
+        # Keep track of dates -- no_date means not scheduled, so t >= date is always false
+        for key in self.date_keys:
+            self[key] = np.full(n, no_date, dtype=date_dtype)
+        return
+
+
+    def __getitem__(self, key):
+        ''' Allow people['attr'] for the array, or people[ind] for a Person view '''
+        if isinstance(key, str):
+            return getattr(self, key)
+        else:
+            return self.person(key)
+
+
+    def __setitem__(self, key, value):
+        ''' Ditto; states are bits of people.state, so they can't be set directly '''
+        if key in self.state_keys:
+            errormsg = f'"{key}" is read from the bits of people.state and cannot be set directly; modify people.state instead'
+            raise AttributeError(errormsg)
+        self.__dict__[key] = value
         return
 
 
+    def __len__(self):
+        return len(self.uid)
+
+
+    def __iter__(self):
+        ''' Iterate over people '''
+        for i in range(len(self)):
+            yield self[i]
+
+
+    def keys(self):
+        ''' Return the names of all the arrays '''
+        return self.person_keys + self.state_keys + self.date_keys
+
+
+    def count_states(self):
+        '''
+        Count the number of susceptible, exposed, infectious, and recovered people
+        on the ship. Rather than summing each array separately, combine the states
+        into a single code per person and count the people with each code.
+        '''
+        keep   = EXPOSED | INFECTIOUS | RECOVERED | ON_SHIP
+        counts = np.bincount(self.state & keep, minlength=keep+1)
+        codes  = np.arange(len(counts))
+        on     = (codes & ON_SHIP) > 0 # Only count people on the ship
+        n_susceptible = counts[on & ((codes & (EXPOSED | RECOVERED)) == 0)].sum()
+        n_exposed     = counts[on & ((codes & EXPOSED) > 0)].sum()
+        n_infectious  = counts[on & ((codes & INFECTIOUS) > 0)].sum()
+        n_recovered   = counts[on & ((codes & RECOVERED) > 0)].sum()
+        return n_susceptible, n_exposed, n_infectious, n_recovered
+
+
+    def person(self, ind):
+        ''' Return a Person object for a single row '''
+        p = Person()
+        for key in self.keys():
+            val = self[key][ind]
+            if key in self.date_keys and val == no_date:
+                val = None
+            setattr(p, key, val)
+        return p
+
+
 class Sim(cv.BaseSim):
     '''
     The Sim class handles the running of the simulation: the number of children,
@@ -59,6 +169,7 @@ class Sim(cv.BaseSim):
         if pars is None:
             pars = cova_pars.make_pars()
         super().__init__(pars) # Initialize and set the parameters as attributes
+        self.datafile = datafile # Stored so other sims can be created with the same data
         self.data = cova_pars.load_data(datafile)
         self.set_seed(self['rand_seed'])
         self.init_results()
@@ -67,21 +178,39 @@ class Sim(cv.BaseSim):
         return
 
 
+    def set_seed(self, seed=-1):
+        '''
+        Set the seed for the random number stream from the stored or supplied
+        value, and create the random number generator used by the sim
+        '''
+        super().set_seed(seed)
+        self.rng = np.random.default_rng(self['rand_seed'])
+        return
+
+
+    @property
+    def off_ship(self):
+        ''' Boolean mask of the people who've been moved off the ship '''
+        return ~self.people.on_ship
+
+
+    # The keys of the results arrays, one value per time point
+    results_keys = [
+        'n_susceptible',
+        'n_exposed',
+        'n_infectious',
+        'n_recovered',
+        'infections',
+        'tests',
+        'diagnoses',
+        'recoveries',
+        'cum_exposed',
+        'cum_tested',
+        'cum_diagnosed',
+        'evac_diagnoses',]
+
     def init_results(self):
         ''' Initialize results '''
-        self.results_keys = [
-            'n_susceptible',
-            'n_exposed',
-            'n_infectious',
-            'n_recovered',
-            'infections',
-            'tests',
-            'diagnoses',
-            'recoveries',
-            'cum_exposed',
-            'cum_tested',
-            'cum_diagnosed',
-            'evac_diagnoses',]
         self.results = {}
         for key in self.results_keys:
             self.results[key] = np.zeros(int(self.npts))
@@ -92,27 +221,21 @@ class Sim(cv.BaseSim):
 
     def init_people(self, seed_infections=1):
         ''' Create the people '''
-        self.people = sc.odict() # Dictionary for storing the people
-        self.off_ship = sc.odict() # For people who've been moved off the ship
-        guests = [0]*self['n_guests']
-        crew   = [1]*self['n_crew']
-        for is_crew in crew+guests: # Loop over each person
-            age,sex = cova_pars.get_age_sex(is_crew)
-            if is_crew:
-                contacts = self['contacts_crew']
-            else:
-                contacts = self['contacts_guest']
-            person = Person(age=age, sex=sex, crew=is_crew, contacts=contacts) # Create the person
-            self.people[person.uid] = person # Save them to the dictionary
+        n_crew = self['n_crew']
+        n_guests = self['n_guests']
+        self.people = PersonArray(n_crew + n_guests) # Arrays for storing the people -- crew first, then guests
+        people = self.people
+        people.crew[:n_crew] = True
+        for is_crew,inds in [[True, slice(None, n_crew)], [False, slice(n_crew, None)]]:
+            n = n_crew if is_crew else n_guests
+            people.age[inds], people.sex[inds] = cova_pars.get_age_sex(is_crew, n=n, rng=self.rng)
+        people.contacts[:] = np.where(people.crew, self['contacts_crew'], self['contacts_guest'])
 
         # Create the seed infections
         for i in range(seed_infections):
-            person = self.people[i]
-            person.susceptible = False
-            person.exposed = True
-            person.infectious = True
-            person.date_exposed = 0
-            person.date_infectious = 0
+            people.state[i] |= EXPOSED | INFECTIOUS
+            people.date_exposed[i] = 0
+            people.date_infectious[i] = 0
 
         return
 
@@ -134,149 +257,132 @@ class Sim(cv.BaseSim):
         # Reset settings and results
         if verbose is None:
             verbose = self['verbose']
+        self.set_seed() # Restart the random number stream, so running the sim again gives the same results
         self.init_results()
         self.init_people(seed_infections=seed_infections) # Actually create the people
-        daily_tests = self.data['new_tests'] # Number of tests each day, from the data
-        evacuated = self.data['evacuated'] # Number of people evacuated
+        daily_tests = self.data['new_tests'].values # Number of tests each day, from the data
+        evacuated = self.data['evacuated'].values # Number of people evacuated
+
+        # Parameters used in the main loop -- these are fixed for the run, so look them up only once
+        r_contact      = self['r_contact']
+        incub          = self['incub']
+        incub_std      = self['incub_std']
+        dur            = self['dur']
+        dur_std        = self['dur_std']
+        sensitivity    = self['sensitivity']
+        symptomatic    = self['symptomatic'] # Changed by the testing change, so copied rather than modified in place
+        evac_positives = self['evac_positives']
+        quarantine     = self['quarantine']
+        testing_change = self['testing_change']
 
         # Main simulation loop
+        people = self.people # Shorten since heavily used
+        print_every = max(1, int(1.0/verbose)) if verbose>0 else 0 # As in Covasim, a fractional verbose prints progress every 1/verbose days
         for t in range(self.npts):
 
-            # Print progress
-            if verbose>=1:
+            # Print progress -- the string is only constructed on days it's printed
+            if print_every and not (t % print_every):
                 string = f'  Running day {t:0.0f} of {self["n_days"]}...'
                 if verbose>=2:
                     sc.heading(string)
                 else:
                     print(string)
 
-            test_probs = {} # Store the probability of each person getting tested
-
-            # Update each person
-            for person in self.people.values():
-
-                # Count susceptibles
-                if person.susceptible:
-                    self.results['n_susceptible'][t] += 1
-                    continue # Don't bother with the rest of the loop
-
-                # Handle testing probability
-                if person.infectious:
-                    test_probs[person.uid] = self['symptomatic'] # They're infectious: high probability of testing
-                else:
-                    test_probs[person.uid] = 1.0
-
-                # If exposed, check if the person becomes infectious
-                if person.exposed:
-                    self.results['n_exposed'][t] += 1
-                    if not person.infectious and t >= person.date_infectious: # It's the day they become infectious
-                        person.infectious = True
-                        if verbose>=2:
-                            print(f'      Person {person.uid} became infectious!')
-
-                # If infectious, check if anyone gets infected
-                if person.infectious:
-                    # First, check for recovery
-                    if person.date_recovered and t >= person.date_recovered: # It's the day they become infectious
-                        person.exposed = False
-                        person.infectious = False
-                        person.recovered = True
-                        self.results['recoveries'][t] += 1
-                    else:
-                        self.results['n_infectious'][t] += 1 # Count this person as infectious
-                        n_contacts = pt(person.contacts) # Draw the number of Poisson contacts for this person
-                        contact_inds = cv.choose(max_n=len(self.people), n=n_contacts) # Choose people at random
-                        for contact_ind in contact_inds:
-                            exposure = bt(self['r_contact']) # Check for exposure per person
-                            if exposure:
-                                target_person = self.people[contact_ind]
-                                if target_person.susceptible: # Skip people who are not susceptible
-                                    self.results['infections'][t] += 1
-                                    target_person.susceptible = False
-                                    target_person.exposed = True
-                                    target_person.date_exposed = t
-                                    incub_pars = dict(dist='normal_int', par1=self['incub'], par2=self['incub_std'])
-                                    dur_pars   = dict(dist='normal_int', par1=self['dur'],   par2=self['dur_std'])
-                                    incub_dist = cv.sample(**incub_pars)
-                                    dur_dist   = cv.sample(**dur_pars)
-
-                                    target_person.date_infectious = t + incub_dist
-                                    target_person.date_recovered = target_person.date_infectious + dur_dist
-                                    if verbose>=2:
-                                        print(f'        Person {person.uid} infected person {target_person.uid}!')
-
-                # Count people who recovered
-                if person.recovered:
-                    self.results['n_recovered'][t] += 1
+            state   = people.state # Shorten since heavily used; this is updated in place
+            on_ship = (state & ON_SHIP) != 0
+            on_inds = np.flatnonzero(on_ship) # Indices of the people still on the ship
+
+            # Count the people in each state at the start of the day
+            n_susceptible, n_exposed, n_infectious, n_recovered = people.count_states()
+            self.results['n_susceptible'][t] = n_susceptible
+            self.results['n_exposed'][t]     = n_exposed
+
+            # Check who becomes infectious
+            newly_infectious = ((state & (EXPOSED | INFECTIOUS | ON_SHIP)) == (EXPOSED | ON_SHIP)) & (t >= people.date_infectious)
+            state[newly_infectious] |= INFECTIOUS
+            if verbose>=2:
+                for i in np.flatnonzero(newly_infectious):
+                    print(f'      Person {people.uid[i]} became infectious!')
+
+            # Check who recovers
+            recovering = ((state & (INFECTIOUS | ON_SHIP)) == (INFECTIOUS | ON_SHIP)) & (t >= people.date_recovered)
+            state[recovering] = (state[recovering] & ~(EXPOSED | INFECTIOUS)) | RECOVERED
+            n_recoveries = np.count_nonzero(recovering)
+            self.results['recoveries'][t]   = n_recoveries
+            self.results['n_infectious'][t] = n_infectious + np.count_nonzero(newly_infectious) - n_recoveries
+            self.results['n_recovered'][t]  = n_recovered + n_recoveries
+
+            # Check if anyone gets infected by each infectious person
+            inf_inds = np.flatnonzero((state & (INFECTIOUS | ON_SHIP)) == (INFECTIOUS | ON_SHIP))
+            sources, targets, exposures = draw_contacts(self.rng, inf_inds, on_inds, people.contacts, r_contact)
+            sources, new_inds = compute_infections(t, sources, targets, exposures, state, people.date_exposed)
+            n_new = len(new_inds)
+            incubs = np.rint(np.abs(self.rng.normal(incub, incub_std, n_new))).astype(date_dtype) # Draw the incubation periods of everyone infected today at once
+            durs   = np.rint(np.abs(self.rng.normal(dur,   dur_std,   n_new))).astype(date_dtype) # ...and the durations of infection
+            people.date_infectious[new_inds] = t + incubs
+            people.date_recovered[new_inds]  = people.date_infectious[new_inds] + durs
+            self.results['infections'][t] = n_new
+            if verbose>=2:
+                for source,target in zip(sources, new_inds):
+                    print(f'        Person {people.uid[source]} infected person {people.uid[target]}!')
 
             # Implement testing -- this is outside of the loop over people, but inside the loop over time
             if t<len(daily_tests): # Don't know how long the data is, ensure we don't go past the end
-                n_tests = daily_tests.iloc[t] # Number of tests for this day
-                if n_tests and not pl.isnan(n_tests): # There are tests this day
+                n_tests = daily_tests[t] # Number of tests for this day
+                if n_tests and not np.isnan(n_tests): # There are tests this day
                     self.results['tests'][t] = n_tests # Store the number of tests
-                    test_probs = pl.array(list(test_probs.values()))
-                    test_probs /= test_probs.sum()
-                    test_inds = cv.choose_w(probs=test_probs, n=n_tests)
-                    uids_to_pop = []
-                    for test_ind in test_inds:
-                        tested_person = self.people[test_ind]
-                        if tested_person.infectious and bt(self['sensitivity']): # Person was tested and is true-positive
-                            self.results['diagnoses'][t] += 1
-                            tested_person.diagnosed = True
-                            if self['evac_positives']:
-                                uids_to_pop.append(tested_person.uid)
-                            if verbose>=2:
-                                        print(f'          Person {person.uid} was diagnosed!')
-                    for uid in uids_to_pop: # Remove people from the ship once they're diagnosed
-                        self.off_ship[uid] = self.people.pop(uid)
+                    other_inds = np.flatnonzero((state & (INFECTIOUS | ON_SHIP)) == ON_SHIP)
+                    test_inds = choose_two_groups(inf_inds, other_inds, odds=symptomatic, n=n_tests, rng=self.rng) # Everyone on the ship can be tested, but infectious people are more likely to be
+                    inf_tested = test_inds[(state[test_inds] & INFECTIOUS) != 0]
+                    diag_inds = inf_tested[self.rng.random(len(inf_tested)) < sensitivity] # People who were tested and are true-positive
+                    self.results['diagnoses'][t] = len(diag_inds)
+                    state[diag_inds] |= DIAGNOSED
+                    people.date_diagnosed[diag_inds] = t
+                    if evac_positives:
+                        state[diag_inds] &= ~ON_SHIP # Remove people from the ship once they're diagnosed
+                    if verbose>=2:
+                        for ind in diag_inds:
+                            print(f'          Person {people.uid[ind]} was diagnosed!')
 
             # Implement quarantine
-            if t == self['quarantine']:
+            if t == quarantine:
                 if verbose>=1:
                     print(f'Implementing quarantine on day {t}...')
-                for person in self.people.values():
-                    if 'quarantine_eff' in self.pars.keys():
-                        quarantine_eff = self['quarantine_eff'] # Both
-                    else:
-                        if person.crew:
-                            quarantine_eff = self['quarantine_eff_c'] # Crew
-                        else:
-                            quarantine_eff = self['quarantine_eff_g'] # Guests
-                    person.contacts *= quarantine_eff
+                if 'quarantine_eff' in self.pars.keys():
+                    people.contacts *= self['quarantine_eff'] # Both
+                else:
+                    people.contacts[people.crew]  *= self['quarantine_eff_c'] # Crew
+                    people.contacts[~people.crew] *= self['quarantine_eff_g'] # Guests
 
             # Implement testing change
-            if t == self['testing_change']:
+            if t == testing_change:
                 if verbose>=1:
                     print(f'Implementing testing change on day {t}...')
-                self['symptomatic'] *= self['testing_symptoms'] # Reduce the proportion of symptomatic testing
+                symptomatic *= self['testing_symptoms'] # Reduce the proportion of symptomatic testing
 
             # Implement evacuations
             if t<len(evacuated):
-                n_evacuated = evacuated.iloc[t] # Number of evacuees for this day
-                if n_evacuated and not pl.isnan(n_evacuated): # There are evacuees this day # TODO -- refactor with n_tests
+                n_evacuated = evacuated[t] # Number of evacuees for this day
+                if n_evacuated and not np.isnan(n_evacuated): # There are evacuees this day # TODO -- refactor with n_tests
                     if verbose>=1:
                         print(f'Implementing evacuation on day {t}')
-                    evac_inds = cv.choose(max_n=len(self.people), n=n_evacuated)
-                    uids_to_pop = []
-                    for evac_ind in evac_inds:
-                        evac_person = self.people[evac_ind]
-                        if evac_person.infectious and bt(self['sensitivity']):
-                            self.results['evac_diagnoses'][t] += 1
-                        uids_to_pop.append(evac_person.uid)
-                    for uid in uids_to_pop: # Remove people from the ship once they're diagnosed
-                        self.off_ship[uid] = self.people.pop(uid)
+                    on_inds = np.flatnonzero(state & ON_SHIP)
+                    evac_inds = self.rng.choice(on_inds, int(n_evacuated), replace=False)
+                    n_inf_evac = np.count_nonzero(state[evac_inds] & INFECTIOUS)
+                    self.results['evac_diagnoses'][t] = np.count_nonzero(self.rng.random(n_inf_evac) < sensitivity)
+                    state[evac_inds] &= ~ON_SHIP # Remove people from the ship once they're evacuated
 
         # Compute cumulative results
-        self.results['cum_exposed']   = pl.cumsum(self.results['infections'])
-        self.results['cum_tested']    = pl.cumsum(self.results['tests'])
-        self.results['cum_diagnosed'] = pl.cumsum(self.results['diagnoses'])
+        np.cumsum(self.results['infections'], out=self.results['cum_exposed'])
+        np.cumsum(self.results['tests'],      out=self.results['cum_tested'])
+        np.cumsum(self.results['diagnoses'],  out=self.results['cum_diagnosed'])
 
-        # Compute likelihood
+        # Compute likelihood -- the results must be marked as ready first, otherwise likelihood() runs the sim again
+        self.results['ready'] = True
         if calc_likelihood:
-            self.likelihood()
+            self.likelihood(verbose=verbose)
 
         # Tidy up
-        self.results['ready'] = True
         elapsed = sc.toc(T, output=True)
         if verbose>=1:
             print(f'\nRun finished after {elapsed:0.1f} s.\n')
@@ -304,15 +410,14 @@ class Sim(cv.BaseSim):
         if not self.results['ready']:
             self.run(calc_likelihood=False, verbose=verbose) # To avoid an infinite loop
 
-        loglike = 0
-        for d,datum in enumerate(self.data['new_positives']):
-            if not pl.isnan(datum): # Skip days when no tests were performed
-                estimate = self.results['diagnoses'][d]
-                p = cv.poisson_test(datum, estimate)
-                logp = pl.log(p)
-                loglike += logp
-                if verbose>=2:
-                    print(f'  {self.data["date"][d]}, data={datum:3.0f}, model={estimate:3.0f}, log(p)={logp:10.4f}, loglike={loglike:10.4f}')
+        data      = self.data['new_positives'].values[:self.npts]
+        days      = np.flatnonzero(~np.isnan(data)) # Skip days when no tests were performed
+        estimates = self.results['diagnoses'][days]
+        logps     = np.log(cv.poisson_test(data[days], estimates)) # The test works elementwise on arrays
+        loglike   = logps.sum()
+        if verbose>=2:
+            for d,datum,estimate,logp,cumlike in zip(days, data[days], estimates, logps, np.cumsum(logps)):
+                print(f'  {self.data["date"][d]}, data={datum:3.0f}, model={estimate:3.0f}, log(p)={logp:10.4f}, loglike={cumlike:10.4f}')
 
         self.results['likelihood'] = loglike
 
@@ -415,14 +520,203 @@ class Sim(cv.BaseSim):
         raise NotImplementedError
 
 
+#%% Define functions for running multiple sims
+
+def single_run(pars, seed=None, datafile=None, run_args=None, resfile=None, ind=0):
+    '''
+    Create and run a single simulation from a set of parameters. Mostly used for
+    parallelization, since only the parameters need to be sent to each worker.
+    If resfile is supplied, the results arrays are written directly into that
+    shared file rather than being sent back, and only the likelihood is returned.
+
+    Args:
+        pars     (dict) : the parameters of the simulation
+        seed     (int)  : the random seed for this run (if None, use the one in pars)
+        datafile (str)  : the data file to load
+        run_args (dict) : arguments passed to sim.run()
+        resfile  (str)  : the file of the memory-mapped results array of shape (n_runs, n_keys, npts), as created by multi_run()
+        ind      (int)  : the index of this run in the results file
+
+    Returns:
+        results (dict): the results of the run, or if written to resfile, the likelihood (None if not calculated)
+
+    **Example**::
+
+        results = cova.single_run(cova.make_pars(), seed=3)
+    '''
+    pars = sc.dcp(pars) # Don't modify the original parameters
+    if seed is not None:
+        pars['rand_seed'] = seed
+    run_args = sc.mergedicts({'verbose':0}, run_args)
+    sim = Sim(pars=pars, datafile=datafile)
+    results = sim.run(**run_args)
+    if resfile is not None:
+        shared = np.memmap(resfile, dtype=np.float64, mode='r+').reshape(-1, len(sim.results_keys), sim.npts)
+        for k,key in enumerate(sim.results_keys):
+            shared[ind, k, :] = results[key]
+        shared.flush()
+        del shared
+        results = results.get('likelihood')
+    return results
+
+
+def multi_run(sim=None, n_runs=4, pars=None, datafile=None, run_args=None, par_args=None, parallel=True):
+    '''
+    Run a simulation multiple times with different random seeds. Rather than
+    copying the sim for each run, each worker creates a new sim from the
+    parameters, and writes its results into a shared memory-mapped array, so
+    nothing needs to be pickled on the way back. The seed for each run is
+    spawned from the sim's seed, so the random number streams are independent.
+
+    Args:
+        sim      (Sim)  : the sim to take the parameters from (if None, use pars)
+        n_runs   (int)  : the number of runs
+        pars     (dict) : the parameters to use if no sim is supplied (if None, use the defaults)
+        datafile (str)  : the data file to load (if None, use the sim's)
+        run_args (dict) : arguments passed to sim.run()
+        par_args (dict) : arguments passed to sc.parallelize()
+        parallel (bool) : whether or not to run in parallel
+
+    Returns:
+        A list of results dicts, one per run, containing the results arrays (and the likelihood, if calculated)
+
+    **Example**::
+
+        sim = cova.Sim()
+        all_results = cova.multi_run(sim, n_runs=6)
+    '''
+    if sim is not None:
+        pars = sim.pars
+        if datafile is None:
+            datafile = sim.datafile
+    elif pars is None:
+        pars = cova_pars.make_pars()
+    max_seed = np.iinfo(np.int32).max # Covasim seeds must fit in an int32
+    seeds = [int(seq.generate_state(1)[0] % max_seed) for seq in np.random.SeedSequence(pars['rand_seed']).spawn(n_runs)]
+    npts = int(pars['n_days'] + 1)
+    keys = Sim.results_keys
+
+    # Run the sims, with each one writing its results into its own slice of the shared array
+    with tempfile.TemporaryDirectory() as tmpdir:
+        resfile = os.path.join(tmpdir, 'results.dat')
+        shared = np.memmap(resfile, dtype=np.float64, mode='w+', shape=(n_runs, len(keys), npts))
+        kwargs = dict(pars=pars, datafile=datafile, run_args=run_args, resfile=resfile)
+        iterkwargs = dict(ind=np.arange(n_runs), seed=seeds)
+        if parallel:
+            likelihoods = sc.parallelize(single_run, iterkwargs=iterkwargs, kwargs=kwargs, **sc.mergedicts(par_args))
+        else:
+            likelihoods = [single_run(ind=ind, seed=seed, **kwargs) for ind,seed in zip(iterkwargs['ind'], iterkwargs['seed'])]
+        values = np.array(shared) # Copy out of the file before it's removed
+        del shared
+
+    # Convert back to a list of results
+    all_results = []
+    for r in range(n_runs):
+        results = {key:values[r,k,:] for k,key in enumerate(keys)}
+        results['t'] = np.arange(npts)
+        if likelihoods[r] is not None:
+            results['likelihood'] = likelihoods[r]
+        all_results.append(results)
+
+    return all_results
+
+
 #%% Define helper functions, with Numba for performance
 
-@nb.njit((nb.float64,))
-def pt(rate):
-    ''' A Poisson trial '''
-    return np.random.poisson(rate, 1)[0]
+# Random numbers are drawn serially from the sim's generator, so the contacts can be filled in using safe parallelization
+safe_parallel = cv.utils.safe_parallel # Set by COVASIM_NUMBA_PARALLEL; with the default ("none"), the prange loops run serially
+cache = cv.utils.cache # As in Covasim, turning this off (COVASIM_NUMBA_CACHE=0) can help switching parallelization options
+nbrng = nb.typeof(np.random.default_rng()) # Numba type of np.random.Generator
+
 
-@nb.njit((nb.float64,))
-def bt(prob):
-    ''' Perform a binomial (Bernolli) trial '''
-    return np.random.random() < prob
\ No newline at end of file
+def choose_two_groups(inds1, inds2, odds, n, rng=None):
+    '''
+    Choose n unique people from two groups, where each person in the first group
+    is odds times as likely to be chosen as each person in the second. This gives
+    the same distribution as weighted sampling without replacement, but without
+    needing a weight for every person: the number chosen from the first group
+    follows Wallenius' noncentral hypergeometric distribution, and then people
+    are chosen uniformly within each group.
+
+    Args:
+        inds1 (array): indices of the people in the first group
+        inds2 (array): indices of the people in the second group
+        odds (float): relative probability of each person in the first group being chosen
+        n (int): number of people to choose
+        rng (Generator): the random number generator to use (if None, use the global Numpy random stream)
+
+    **Example**::
+
+        inds = choose_two_groups([0, 1], [2, 3, 4, 5], odds=5, n=3) # Choose 3 people, most likely including 0 and 1
+    '''
+    n = int(n)
+    if rng is None:
+        rng = np.random
+    n1 = len(inds1)
+    n2 = len(inds2)
+    if n > n1 + n2:
+        errormsg = f'Cannot choose {n} people from two groups with only {n1} and {n2} people'
+        raise ValueError(errormsg)
+    random_state = None if rng is np.random else rng # SciPy uses the global stream for None
+    k1 = int(sps.nchypergeom_wallenius.rvs(n1+n2, n1, n, odds, random_state=random_state)) # Number of people chosen from the first group
+    inds = np.concatenate([rng.choice(inds1, k1, replace=False), rng.choice(inds2, n-k1, replace=False)])
+    return inds
+
+
+@nb.njit((nbrng, nb.int64[:], nb.int64[:], nb.float64[:], nb.float64), cache=cache, parallel=safe_parallel, nogil=True)
+def draw_contacts(rng, inf_inds, on_inds, contacts, r_contact): # pragma: no cover
+    '''
+    Draw the contacts of each infectious person, and whether each contact results
+    in an exposure. Each infectious person draws a Poisson number of contacts from
+    the people on the ship, each of whom is exposed with probability r_contact.
+
+    All random numbers are drawn serially from rng so the results are reproducible;
+    a prefix sum of the number of contacts then gives each infectious person its
+    own slice of the output arrays, which are filled in parallel.
+
+    Returns:
+        sources, targets, exposures (arrays): the infectious person, the contact, and whether they were exposed, for each contact
+    '''
+    n_on = len(on_inds)
+    n_inf = len(inf_inds)
+    n_contacts = np.empty(n_inf, dtype=np.int64)
+    for k in range(n_inf):
+        n_contacts[k] = rng.poisson(contacts[inf_inds[k]])
+    offsets = np.zeros(n_inf+1, dtype=np.int64)
+    offsets[1:] = np.cumsum(n_contacts)
+    target_draws   = rng.random(offsets[-1])
+    exposure_draws = rng.random(offsets[-1])
+    sources   = np.empty(offsets[-1], dtype=np.int64)
+    targets   = np.empty(offsets[-1], dtype=np.int64)
+    exposures = np.empty(offsets[-1], dtype=np.bool_)
+    for k in nb.prange(n_inf):
+        for j in range(offsets[k], offsets[k+1]):
+            sources[j]   = inf_inds[k]
+            targets[j]   = on_inds[int(target_draws[j]*n_on)] # Choose a person at random
+            exposures[j] = exposure_draws[j] < r_contact # Check for exposure
+    return sources, targets, exposures
+
+
+@nb.njit((nb.int64, nb.int64[:], nb.int64[:], nb.bool_[:], nb.uint8[:], nb.int16[:]), cache=True)
+def compute_infections(t, sources, targets, exposures, state, date_exposed): # pragma: no cover
+    '''
+    Compute who infects whom on day t from the output of draw_contacts(), and
+    mark the newly infected people as exposed in place. Contacts are processed in
+    order, so a person exposed by several sources is only infected by the first.
+    Their incubation and infection durations are drawn afterwards, all at once.
+
+    Returns:
+        sources, targets (arrays): the indices of the infectors and the newly infected people
+    '''
+    new_sources = np.empty(len(targets), dtype=np.int64)
+    new_targets = np.empty(len(targets), dtype=np.int64)
+    n_new = 0
+    for j in range(len(targets)):
+        target = targets[j]
+        if exposures[j] and (state[target] & (EXPOSED | RECOVERED)) == 0: # Skip people who are not susceptible
+            state[target] |= EXPOSED
+            date_exposed[target] = t
+            new_sources[n_new] = sources[j]
+            new_targets[n_new] = target
+            n_new += 1
+    return new_sources[:n_new], new_targets[:n_new]
@@ -3,7 +3,7 @@ Set the parameters for COVID-ABM.
 '''
 
 import os
-import pylab as pl
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
@@ -21,7 +21,7 @@ def make_pars():
     pars['day_0']      = datetime(2020, 1, 22) # Start day of the epidemic
     pars['n_days']     = 32 # How many days to simulate -- 31 days is until 2020-Feb-20
     pars['rand_seed']  = 1 # Random seed, if None, don't reset
-    pars['verbose']    = 1 # Whether or not to display information during the run -- options are 0 (silent), 1 (default), 2 (everything)
+    pars['verbose']    = 1 # Whether or not to display information during the run -- options are 0 (silent), 0.1 (progress every 10 days), 1 (default), 2 (everything)
 
     # Epidemic parameters
     pars['r_contact']      = 0.05 # Probability of infection per contact, estimated
@@ -46,7 +46,7 @@ def make_pars():
     return pars
 
 
-def get_age_sex(is_crew=False, min_age=18, max_age=99, crew_age=35, crew_std=5, guest_age=68, guest_std=8):
+def get_age_sex(is_crew=False, min_age=18, max_age=99, crew_age=35, crew_std=5, guest_age=68, guest_std=8, n=None, rng=None):
     '''
     Define age-sex distributions. Passenger age distribution based on:
 
@@ -54,19 +54,26 @@ def get_age_sex(is_crew=False, min_age=18, max_age=99, crew_age=35, crew_std=5,
 
     "About 80% of the passengers were aged 60 or over [=2130], with 215 in their 80s and 11 in the 90s,
     the English-language Japan Times newspaper reported."
+
+    If n is supplied, return arrays of n ages and sexes rather than single values.
+    If rng (a np.random.Generator) is not supplied, the global Numpy random
+    stream is used, so results can be reproduced with cv.set_seed().
     '''
 
+    if rng is None:
+        rng = np.random
+
     # Define female (0) or male (1) -- evenly distributed
-    sex = pl.randint(2)
+    sex = rng.choice(2, size=n)
 
     # Define age distribution for the crew and guests
     if is_crew:
-        age = pl.normal(crew_age, crew_std)
+        age = rng.normal(crew_age, crew_std, size=n)
     else:
-        age = pl.normal(guest_age, guest_std)
+        age = rng.normal(guest_age, guest_std, size=n)
 
     # Normalize
-    age = pl.median([min_age, age, max_age])
+    age = np.clip(age, min_age, max_age)
 
     return age, sex
 
@@ -4,8 +4,10 @@ Cruise-ship specific tests
 
 #%% Imports and settings
 import pytest
+import numpy as np
 import sciris as sc
 import cruise_ship as cova
+import model as cvm
 
 doplot = 1
 
@@ -39,6 +41,11 @@ def test_sim(doplot=False): # If being run via pytest, turn off
     sim.set_seed(seed)
     sim.run(verbose=verbose)
 
+    # Check that running it again gives the same results
+    cum_exposed = sim.results['cum_exposed'].copy()
+    sim.run(verbose=0)
+    assert (sim.results['cum_exposed'] == cum_exposed).all()
+
     # Optionally plot
     if doplot:
         sim.plot()
@@ -46,6 +53,99 @@ def test_sim(doplot=False): # If being run via pytest, turn off
     return sim
 
 
+def test_people():
+
+    # Create the people and check that the arrays are consistent
+    sim = cova.Sim()
+    people = sim.people
+    assert len(people) == sim['n_crew'] + sim['n_guests']
+    assert people.crew.sum() == sim['n_crew']
+    assert people.exposed.sum() == np.count_nonzero(people.state & cvm.EXPOSED)
+    assert people.susceptible.sum() == len(people) - 1 # All but the seed infection
+
+    # Check that the states follow the bits of people.state, and can't be set directly
+    ind = len(people) - 1
+    people.state[ind] |= cvm.EXPOSED
+    assert people['exposed'][ind] and not people.susceptible[ind]
+    people.state[ind] &= ~cvm.EXPOSED
+    assert not people['exposed'][ind] and people.susceptible[ind]
+    with pytest.raises(AttributeError):
+        people['exposed'] = np.ones(len(people), dtype=bool)
+
+    # Check that a single row can be pulled out as a person
+    person = people[0]
+    assert isinstance(person, cova.Person)
+    assert person.infectious and person.crew
+
+    return people
+
+
+def test_draw_contacts():
+
+    # Compile the kernel with parallelization on, since by default it runs serially, and check it gives the same contacts
+    sim = cova.Sim()
+    people = sim.people
+    inf_inds = np.arange(0, len(people), 50)
+    on_inds = np.arange(len(people))
+    par_draw_contacts = cvm.nb.njit(parallel=True)(cvm.draw_contacts.py_func)
+    serial   = cvm.draw_contacts(np.random.default_rng(1), inf_inds, on_inds, people.contacts, 0.5)
+    parallel = par_draw_contacts(np.random.default_rng(1), inf_inds, on_inds, people.contacts, 0.5)
+    for s,p in zip(serial, parallel):
+        assert (s == p).all()
+    sources, targets, exposures = serial
+    assert len(sources) > 0 and np.isin(sources, inf_inds).all()
+
+    return serial
+
+
+def test_choose_two_groups():
+
+    # Check the edge cases, where one group is empty or no one is chosen
+    rng = np.random.default_rng(1)
+    inds1 = np.arange(10)
+    inds2 = np.arange(10, 50)
+    empty = np.array([], dtype=int)
+    assert set(cvm.choose_two_groups(empty, inds2, odds=5, n=5, rng=rng)) <= set(inds2)
+    assert sorted(cvm.choose_two_groups(inds1, empty, odds=5, n=10, rng=rng)) == list(inds1)
+    assert len(cvm.choose_two_groups(inds1, inds2, odds=5, n=0, rng=rng)) == 0
+    with pytest.raises(ValueError):
+        cvm.choose_two_groups(inds1, inds2, odds=5, n=51, rng=rng)
+
+    # Check that the number chosen from the first group matches weighted sampling without replacement
+    n_trials = 2000
+    odds = 5
+    n = 15
+    inds = np.concatenate([inds1, inds2])
+    weights = np.where(inds < 10, odds, 1.0)
+    k1_groups   = [np.count_nonzero(cvm.choose_two_groups(inds1, inds2, odds=odds, n=n, rng=rng) < 10) for t in range(n_trials)]
+    k1_weighted = [np.count_nonzero(rng.choice(inds, n, replace=False, p=weights/weights.sum()) < 10) for t in range(n_trials)]
+    assert abs(np.mean(k1_groups) - np.mean(k1_weighted)) < 0.2
+
+    return k1_groups, k1_weighted
+
+
+def test_multi_run():
+
+    # Check that each run uses a different seed
+    sim = cova.Sim()
+    all_results = cova.multi_run(sim, n_runs=3)
+    assert len(all_results) == 3
+    assert all_results[0]['cum_exposed'][-1] != all_results[1]['cum_exposed'][-1]
+
+    # Check that a serial run gives the same results as a parallel one
+    serial_results = cova.multi_run(sim, n_runs=3, parallel=False)
+    for results,serial in zip(all_results, serial_results):
+        assert (results['cum_exposed'] == serial['cum_exposed']).all()
+
+    # Check that the likelihood is kept if it's calculated
+    like_results = cova.multi_run(sim, n_runs=2, run_args={'calc_likelihood':True}, parallel=False)
+    for results in like_results:
+        assert np.isfinite(results['likelihood'])
+    assert 'likelihood' not in all_results[0]
+
+    return all_results
+
+
 
 
 #%% Run as a script
@@ -54,6 +154,10 @@ if __name__ == '__main__':
 
     parsobj = test_parsobj()
     sim     = test_sim(doplot=doplot)
+    people  = test_people()
+    contacts = test_draw_contacts()
+    k1s     = test_choose_two_groups()
+    results = test_multi_run()
 
     sc.toc()
 